@@ -1,7 +1,18 @@
 import os
+import json
+import stat
 import shutil
 import yaml
 
+# 优先使用libyaml提供的C加速解析器
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# 配置缓存结构版本，缓存格式变化时递增使旧缓存失效
+CONFIG_CACHE_VERSION = 1
+
 def get_base_dir():
     """获取项目根目录（EmbyIPLimit目录）"""
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +54,48 @@ DEFAULT_CONFIG = {
     }
 }
 
+def _load_config_cache(config_file, cache_file):
+    """读取与config.yaml同步的JSON缓存，缓存过期或无效时返回None"""
+    try:
+        # 缓存的修改时间与config.yaml完全一致，任何不同（包括换成更旧的文件）都视为过期
+        config_stat = os.stat(config_file)
+        if config_stat.st_mtime_ns != os.stat(cache_file).st_mtime_ns:
+            return None
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if not isinstance(cached, dict) or cached.get('version') != CONFIG_CACHE_VERSION:
+        return None
+    if cached.get('size') != config_stat.st_size:
+        return None
+    return cached.get('config')
+
+def _save_config_cache(config_file, cache_file, user_config):
+    """将解析后的用户配置写入JSON缓存，并同步config.yaml的修改时间"""
+    try:
+        config_stat = os.stat(config_file)
+        # 缓存包含api_key等敏感信息，权限与config.yaml保持一致
+        mode = stat.S_IMODE(config_stat.st_mode)
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # 已存在的缓存文件不受O_CREAT权限影响，需显式修改
+            os.chmod(cache_file, mode)
+            json.dump({
+                'version': CONFIG_CACHE_VERSION,
+                'size': config_stat.st_size,
+                'config': user_config
+            }, f, ensure_ascii=False)
+        os.utime(cache_file, ns=(config_stat.st_mtime_ns, config_stat.st_mtime_ns))
+    except (OSError, TypeError, ValueError) as e:
+        # YAML中可能包含无法JSON序列化的值（如日期），此时放弃缓存
+        print(f"⚠️ 配置缓存写入失败: {str(e)}")
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+
 def load_config():
     """加载配置并管理依赖文件"""
     data_dir = get_data_dir()
@@ -64,9 +117,13 @@ def load_config():
         shutil.copy2(default_config_path, config_file)
         print(f"📄 配置文件已生成于: {config_file}，请填写必要项后重启容器")
     
-    # 加载用户配置
-    with open(config_file, 'r') as f:
-        user_config = yaml.safe_load(f) or {}
+    # 加载用户配置（优先使用JSON缓存）
+    cache_file = os.path.join(data_dir, 'config.json')
+    user_config = _load_config_cache(config_file, cache_file)
+    if user_config is None:
+        with open(config_file, 'r') as f:
+            user_config = yaml.load(f, Loader=YamlLoader) or {}
+        _save_config_cache(config_file, cache_file, user_config)
     
     # 深度合并配置
     config = DEFAULT_CONFIG.copy()
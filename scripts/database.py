@@ -1,6 +1,43 @@
 import os
+import queue
 import sqlite3
+import threading
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+# 数据库结构版本（PRAGMA user_version），新增迁移时递增
+SCHEMA_VERSION = 1
+
+# 后台线程单个事务最多写入的条目数
+WRITE_BATCH_SIZE = 100
+
+# 写入类型对应的SQL语句
+_STATEMENTS = {
+    'session_start': '''
+        INSERT INTO playback_history (
+            session_id, user_id, username, ip_address,
+            device_name, client_type, media_name, 
+            start_time, location
+        ) VALUES (?,?,?,?,?,?,?,?,?)
+    ''',
+    'session_end': '''
+        UPDATE playback_history 
+        SET end_time = ?, duration = ?
+        WHERE session_id = ?
+    ''',
+    'security_event': '''
+        INSERT INTO security_log 
+        (timestamp, user_id, username, trigger_ip, active_sessions, action)
+        VALUES (?,?,?,?,?,?)
+    '''
+}
+
+# datetime参数在绑定时转换为 'YYYY-MM-DD HH:MM:SS'，与原有存储格式一致
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(sep=' ', timespec='seconds'))
+
+# 通知写入线程退出的哨兵
+_STOP = object()
 
 def get_data_dir():
     """获取data目录路径"""
@@ -13,13 +50,37 @@ class DatabaseManager:
         
         # 从配置获取数据库名称
         self.db_path = os.path.join(data_dir, db_name) if db_name else os.path.join(data_dir, 'emby_playback.db')
+        
+        # 在整个生命周期内复用同一连接（自动提交模式），由锁保证跨线程安全
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
         self.init_db()
+        
+        # 写入操作放入队列，由后台线程批量提交，不阻塞监控循环
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+        self._writer.start()
+    
+    def close(self):
+        """写完队列中的剩余数据后关闭数据库连接"""
+        self._queue.put(_STOP)
+        self._writer.join()
+        with self.lock:
+            self.conn.close()
     
     def init_db(self):
         """初始化数据库结构"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.lock:
+            # WAL + synchronous=NORMAL 减少每次提交的fsync次数
+            # 代价是系统崩溃时可能丢失最后约一秒的会话记录，对监控场景可以接受
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('PRAGMA cache_size=-8000')
+            self.conn.execute('PRAGMA mmap_size=67108864')
+            self.conn.execute('PRAGMA temp_store=MEMORY')
+            
             # 播放历史表
-            conn.execute('''
+            self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS playback_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     session_id TEXT NOT NULL,
@@ -35,9 +96,11 @@ class DatabaseManager:
                     location TEXT
                 )
             ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_ph_session ON playback_history(session_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_ph_user_ip ON playback_history(user_id, ip_address)')
             
             # 安全日志表（带自动迁移）
-            conn.execute('''
+            self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS security_log (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     timestamp DATETIME,
@@ -48,28 +111,72 @@ class DatabaseManager:
                     action TEXT
                 )
             ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_sl_ts ON security_log(timestamp)')
             
-            # 检查旧表结构
+            # 按结构版本执行迁移，已是最新版本时跳过
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < 1:
+                # 检查旧表结构
+                try:
+                    cursor = self.conn.execute("PRAGMA table_info(security_log)")
+                    columns = [row[1] for row in cursor.fetchall()]
+                    if 'username' not in columns:
+                        self.conn.execute('ALTER TABLE security_log ADD COLUMN username TEXT')
+                except sqlite3.OperationalError:
+                    pass
+            if version < SCHEMA_VERSION:
+                self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _writer_loop(self):
+        """后台写入线程：攒批后以单个事务写入"""
+        while True:
             try:
-                cursor = conn.execute("PRAGMA table_info(security_log)")
-                columns = [row[1] for row in cursor.fetchall()]
-                if 'username' not in columns:
-                    conn.execute('ALTER TABLE security_log ADD COLUMN username TEXT')
-            except sqlite3.OperationalError:
-                pass
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
             
-            conn.commit()
+            batch = [item]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = _STOP in batch
+            self._write_batch([entry for entry in batch if entry is not _STOP])
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        """按入队顺序将连续的同类写入合并为executemany"""
+        if not batch:
+            return
+        with self.lock:
+            try:
+                self.conn.execute('BEGIN')
+                try:
+                    for kind, rows in groupby(batch, key=itemgetter(0)):
+                        self.conn.executemany(_STATEMENTS[kind], [row for _, row in rows])
+                    self.conn.execute('COMMIT')
+                except Exception:
+                    self.conn.execute('ROLLBACK')
+                    raise
+            except Exception:
+                # 整批失败时逐条重试，避免单条异常数据连带丢失其他记录
+                for kind, row in batch:
+                    try:
+                        self.conn.execute(_STATEMENTS[kind], row)
+                    except Exception as e:
+                        print(f"❌ 数据库写入失败: {str(e)}")
 
     def record_session_start(self, session_data):
         """记录播放开始"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT INTO playback_history (
-                    session_id, user_id, username, ip_address,
-                    device_name, client_type, media_name, 
-                    start_time, location
-                ) VALUES (?,?,?,?,?,?,?,?,?)
-            ''', (
+        self.record_session_starts([session_data])
+
+    def record_session_starts(self, sessions):
+        """批量记录播放开始"""
+        for session_data in sessions:
+            self._queue.put(('session_start', (
                 session_data['session_id'],
                 session_data['user_id'],
                 session_data['username'],
@@ -77,38 +184,30 @@ class DatabaseManager:
                 session_data['device'],
                 session_data['client'],
                 session_data['media'],
-                session_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                session_data['start_time'],
                 session_data.get('location', '未知位置')
-            ))
-            conn.commit()
+            )))
 
     def record_session_end(self, session_id, end_time, duration):
         """记录播放结束"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                UPDATE playback_history 
-                SET end_time = ?, duration = ?
-                WHERE session_id = ?
-            ''', (
-                end_time.strftime('%Y-%m-%d %H:%M:%S'),
+        self.record_session_ends([(session_id, end_time, duration)])
+
+    def record_session_ends(self, sessions):
+        """批量记录播放结束，sessions为(session_id, end_time, duration)列表"""
+        for session_id, end_time, duration in sessions:
+            self._queue.put(('session_end', (
+                end_time,
                 duration,
                 session_id
-            ))
-            conn.commit()
+            )))
 
     def log_security_event(self, log_data):
         """记录安全日志"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT INTO security_log 
-                (timestamp, user_id, username, trigger_ip, active_sessions, action)
-                VALUES (?,?,?,?,?,?)
-            ''', (
-                log_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
-                log_data['user_id'],
-                log_data['username'],
-                log_data['trigger_ip'],
-                log_data['active_sessions'],
-                log_data['action']
-            ))
-            conn.commit()
\ No newline at end of file
+        self._queue.put(('security_event', (
+            log_data['timestamp'],
+            log_data['user_id'],
+            log_data['username'],
+            log_data['trigger_ip'],
+            log_data['active_sessions'],
+            log_data['action']
+        )))
\ No newline at end of file
@@ -1,14 +1,16 @@
 from config_loader import load_config
-from database import DatabaseManager
-from emby_client import EmbyClient
-from security import EmbySecurity
-from monitor import EmbyMonitor
 
 def main():
     print("start")
     # 加载配置
     config = load_config()
     
+    # 配置校验通过后再导入依赖requests的模块，缺失配置时可快速退出
+    from database import DatabaseManager
+    from emby_client import EmbyClient
+    from security import EmbySecurity
+    from monitor import EmbyMonitor
+    
     # 初始化核心组件
     db_manager = DatabaseManager(config['database']['name'])
     emby_client = EmbyClient(
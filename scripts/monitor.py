@@ -1,12 +1,33 @@
 import os
+import json
 import time
 import sqlite3
 import socket
 import re
+import ipaddress
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
 from webhook_notifier import WebhookNotifier
 
+# 可选依赖：orjson解析更快，未安装时回退到标准库
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# 地理位置缓存：有效期（秒）与最大条目数
+GEO_CACHE_TTL = 3600
+GEO_CACHE_SIZE = 1024
+# 单次地理位置查询的最长等待时间（秒）
+GEO_LOOKUP_TIMEOUT = 5
+# 用户信息缓存有效期（秒）
+USER_CACHE_TTL = 300
+
 class EmbyMonitor:
     def __init__(self, db_manager, emby_client, security_client, config):
         self.db = db_manager
@@ -14,11 +35,24 @@ class EmbyMonitor:
         self.security = security_client
         self.config = config
         self.active_sessions = {}
+        # 用户ID -> 活跃会话IP计数，用于快速判断并发登录
+        self._user_ips = defaultdict(Counter)
+        
+        # 复用HTTP连接池，避免每次地理位置查询重新握手
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        # IP -> (查询时间, 位置)，按最近使用顺序淘汰
+        self._geo_cache = OrderedDict()
+        self._geo_lock = threading.Lock()
+        # 多个新会话的地理位置查询并发执行
+        self._geo_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='geo')
+        # 用户ID -> (查询时间, 用户信息)
+        self._user_cache = {}
         
         # 预处理白名单（不区分大小写）
-        self.whitelist = [name.strip().lower() 
-                         for name in config['security']['whitelist'] 
-                         if name.strip()]
+        self.whitelist = frozenset(name.strip().lower()
+                                   for name in config['security']['whitelist']
+                                   if name.strip())
         
         # 安全配置
         self.auto_disable = config['security']['auto_disable']
@@ -98,29 +132,56 @@ class EmbyMonitor:
         """核心会话处理逻辑"""
         try:
             current_sessions = self.emby.get_active_sessions()
+            # 字典视图直接做集合运算，无需复制键列表
+            ended_ids = self.active_sessions.keys() - current_sessions.keys()
+            
             self._detect_new_sessions(current_sessions)
-            self._detect_ended_sessions(current_sessions)
+            self._detect_ended_sessions(ended_ids)
         except Exception as e:
             print(f"❌ 会话更新失败: {str(e)}")
 
     def _detect_new_sessions(self, current_sessions):
         """识别新会话"""
+        # 先过滤白名单，再并发提交其余新会话的地理位置查询
+        pending = []
+        # 按Emby返回的会话顺序处理，保证告警时的触发IP和设备信息稳定
         for session_id, session in current_sessions.items():
-            if session_id not in self.active_sessions:
-                self._record_session_start(session)
+            if session_id in self.active_sessions:
+                continue
+            prepared = self._prepare_session_start(session)
+            if prepared:
+                pending.append(prepared)
+        
+        started = []
+        for session, username, ip_address, location_future in pending:
+            session_data = self._record_session_start(session, username, ip_address, location_future)
+            if session_data:
+                started.append(session_data)
+        
+        if started:
+            try:
+                self.db.record_session_starts(started)
+            except Exception as e:
+                print(f"❌ 会话记录失败: {str(e)}")
 
-    def _detect_ended_sessions(self, current_sessions):
+    def _detect_ended_sessions(self, ended_ids):
         """识别结束会话"""
-        ended = set(self.active_sessions.keys()) - set(current_sessions.keys())
-        for sid in ended:
-            self._record_session_end(sid)
+        finished = []
+        for sid in ended_ids:
+            record = self._record_session_end(sid)
+            if record:
+                finished.append(record)
+        
+        if finished:
+            try:
+                self.db.record_session_ends(finished)
+            except Exception as e:
+                print(f"❌ 结束记录失败: {str(e)}")
 
-    def _record_session_start(self, session):
-        """记录新会话"""
+    def _prepare_session_start(self, session):
+        """白名单检查并提交地理位置查询，返回(session, username, ip, future)"""
         try:
-            user_id = session['UserId']
-            user_info = self.emby.get_user_info(user_id)
-            ip_address = self._extract_ip_address(session.get('RemoteEndPoint', ''))
+            user_info = self._user_info(session['UserId'])
             username = user_info.get('Name', '未知用户').strip()
 
             # 白名单检查
@@ -128,12 +189,28 @@ class EmbyMonitor:
                 print(f"⚪ 白名单用户 [{username}] 跳过监控")
                 return
 
+            ip_address = self._extract_ip_address(session.get('RemoteEndPoint', ''))
+            return session, username, ip_address, self._geo_pool.submit(self._get_location, ip_address)
+        except KeyError as e:
+            print(f"❌ 会话数据缺失关键字段: {str(e)}")
+        except Exception as e:
+            print(f"❌ 会话记录失败: {str(e)}")
+
+    def _record_session_start(self, session, username, ip_address, location_future):
+        """记录新会话，返回待入库的会话数据"""
+        try:
+            user_id = session['UserId']
+
             # 获取媒体信息
             media_item = session.get('NowPlayingItem', {})
             media_name = self.emby.parse_media_info(media_item)
             
             # 获取地理位置
-            location = self._get_location(ip_address)
+            try:
+                location = location_future.result(timeout=GEO_LOOKUP_TIMEOUT)
+            except FutureTimeoutError:
+                print(f"📍 解析 {ip_address} 超时")
+                location = "解析失败"
 
             session_data = {
                 'session_id': session['Id'],
@@ -147,8 +224,8 @@ class EmbyMonitor:
                 'location': location
             }
 
-            self.db.record_session_start(session_data)
             self.active_sessions[session['Id']] = session_data
+            self._user_ips[user_id][ip_address] += 1
             
             # 显示IP地址类型信息
             ip_type = "IPv6" if self._is_ipv6(ip_address) else "IPv4" if self._is_ipv4(ip_address) else "未知"
@@ -156,37 +233,77 @@ class EmbyMonitor:
             
             # 触发异常检测
             self._check_login_abnormality(user_id, ip_address)
+            return session_data
         except KeyError as e:
             print(f"❌ 会话数据缺失关键字段: {str(e)}")
         except Exception as e:
             print(f"❌ 会话记录失败: {str(e)}")
 
+    def _user_info(self, user_id):
+        """获取用户信息（带缓存）"""
+        cached = self._user_cache.get(user_id)
+        if cached and time.time() - cached[0] < USER_CACHE_TTL:
+            return cached[1]
+        
+        user_info = self.emby.get_user_info(user_id)
+        # 请求失败时返回空字典，不缓存
+        if user_info:
+            self._user_cache[user_id] = (time.time(), user_info)
+        return user_info
+
     def _record_session_end(self, session_id):
-        """记录会话结束"""
+        """记录会话结束，返回待入库的(session_id, end_time, duration)"""
         try:
             session_data = self.active_sessions[session_id]
             end_time = datetime.now()
             duration = int((end_time - session_data['start_time']).total_seconds())
             
-            self.db.record_session_end(session_id, end_time, duration)
             print(f"[■] {session_data['username']} | 时长: {duration//60}分{duration%60}秒")
             del self.active_sessions[session_id]
+            self._release_user_ip(session_data['user_id'], session_data['ip'])
+            return (session_id, end_time, duration)
         except KeyError:
             print(f"⚠️ 会话 {session_id} 已不存在")
         except Exception as e:
             print(f"❌ 结束记录失败: {str(e)}")
 
     def _get_location(self, ip_address):
-        """解析地理位置"""
+        """解析地理位置（带缓存）"""
         if not ip_address:
             return "未知位置"
         
+        # 内网、回环及链路本地地址无需查询API
+        try:
+            addr = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return "未知位置"
+        if addr.is_private or addr.is_loopback or addr.is_link_local:
+            return "内网"
+        
+        with self._geo_lock:
+            cached = self._geo_cache.get(ip_address)
+            if cached and time.time() - cached[0] < GEO_CACHE_TTL:
+                self._geo_cache.move_to_end(ip_address)
+                return cached[1]
+        
+        location = self._query_location(ip_address)
+        # 查询失败不缓存，下次重试
+        if location != "解析失败":
+            with self._geo_lock:
+                self._geo_cache[ip_address] = (time.time(), location)
+                self._geo_cache.move_to_end(ip_address)
+                if len(self._geo_cache) > GEO_CACHE_SIZE:
+                    self._geo_cache.popitem(last=False)
+        return location
+
+    def _query_location(self, ip_address):
+        """调用API查询地理位置"""
         # 支持IPv4和IPv6地址的地理位置查询
         try:
             api_url = f"https://api.vore.top/api/IPdata?ip={ip_address}"
-            response = requests.get(api_url)
+            response = self.http.get(api_url, timeout=(2, 5))
             if response.status_code == 200:
-                data = response.json()
+                data = _json_loads(response.content)
                 if data['code'] == 200 and 'ipdata' in data:
                     ipdata = data['ipdata']
                     loc_parts = []
@@ -208,15 +325,23 @@ class EmbyMonitor:
             print(f"📍 解析 {ip_address} 失败: {str(e)}")
             return "解析失败"
 
+    def _release_user_ip(self, user_id, ip_address):
+        """会话结束时更新用户IP计数"""
+        ips = self._user_ips.get(user_id)
+        if not ips:
+            return
+        ips[ip_address] -= 1
+        if ips[ip_address] <= 0:
+            del ips[ip_address]
+        if not ips:
+            del self._user_ips[user_id]
+
     def _check_login_abnormality(self, user_id, new_ip):
         """检测登录异常"""
         if not self.alerts_enabled:
             return
         
-        existing_ips = set()
-        for sess in self.active_sessions.values():
-            if sess['user_id'] == user_id and sess['ip'] != new_ip:
-                existing_ips.add(sess['ip'])
+        existing_ips = self._user_ips.get(user_id, {}).keys() - {new_ip}
         
         if len(existing_ips) >= (self.alert_threshold - 1):
             self._trigger_alert(user_id, new_ip, len(existing_ips)+1)
@@ -224,7 +349,7 @@ class EmbyMonitor:
     def _trigger_alert(self, user_id, trigger_ip, session_count):
         """触发安全告警"""
         try:
-            user_info = self.emby.get_user_info(user_id)
+            user_info = self._user_info(user_id)
             username = user_info.get('Name', '未知用户').strip()
             
             # 最终白名单确认
@@ -257,6 +382,8 @@ class EmbyMonitor:
             
             if self.auto_disable:
                 if self.security.disable_user(user_id, username):
+                    # 用户状态已变化，清除缓存
+                    self._user_cache.pop(user_id, None)
                     self._log_security_action(user_id, trigger_ip, session_count, username)
                     
                     # 发送Webhook通知
@@ -317,10 +444,21 @@ class EmbyMonitor:
         """启动监控服务"""
         print(f"🔍 监控服务启动 | 数据库: {self.config['database']['name']}")
         try:
+            # 按固定节拍轮询，处理耗时计入间隔内
+            next_tick = time.monotonic()
             while True:
                 self.process_sessions()
-                time.sleep(self.config['monitor']['check_interval'])
+                next_tick += self.config['monitor']['check_interval']
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # 处理超时，从当前时间重新计时，避免连续补轮询
+                    next_tick = time.monotonic()
         except KeyboardInterrupt:
             print("\n🛑 监控服务已安全停止")
         except Exception as e:
-            print(f"❌ 监控服务异常终止: {str(e)}")
\ No newline at end of file
+            print(f"❌ 监控服务异常终止: {str(e)}")
+        finally:
+            self._geo_pool.shutdown(wait=False)
+            self.db.close()
\ No newline at end of file
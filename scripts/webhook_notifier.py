@@ -5,12 +5,44 @@
 """
 
 import json
+import string
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError, TimeoutError as Urllib3TimeoutError
+from urllib3.util.retry import Retry
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# 可选依赖：orjson序列化更快，未安装时回退到标准库
+try:
+    import orjson
+
+    def _json_dumps(payload):
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def _json_dumps(payload):
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+_formatter = string.Formatter()
+
+class _CompiledTemplate:
+    """预解析的模板字符串"""
+    __slots__ = ('source', 'tokens')
+
+    def __init__(self, source):
+        self.source = source
+        try:
+            self.tokens = list(_formatter.parse(source))
+        except ValueError:
+            # 模板语法错误，发送时按原逻辑报告
+            self.tokens = None
+            return
+        # 嵌套格式说明（如 {x:{width}}）较少见，交给str.format处理
+        if any(spec and '{' in spec for _, _, spec, _ in self.tokens):
+            self.tokens = None
+
 class WebhookNotifier:
     def __init__(self, config):
         """
@@ -29,8 +61,25 @@ class WebhookNotifier:
         self.timeout = config.get('timeout', 10)
         self.retry_attempts = config.get('retry_attempts', 3)
         
+        # 复用HTTP会话，由urllib3负责指数退避重试
+        retry = Retry(
+            total=self.retry_attempts,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False,
+            # 通知在监控线程中同步发送，不能按服务端Retry-After长时间等待
+            respect_retry_after_header=False
+        )
+        adapter = HTTPAdapter(max_retries=retry)
+        self.http = requests.Session()
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        
         # 动态加载body配置
         self.body_config = config.get('body', {})
+        # 预解析body中的模板字符串，发送时无需重复解析
+        self._compiled_body = self._compile_template(self.body_config)
         
         if self.enabled and not self.url:
             logger.warning("Webhook已启用但未配置URL")
@@ -75,24 +124,62 @@ class WebhookNotifier:
             logger.error(f"构建Webhook通知失败: {e}")
             return False
 
+    def _compile_template(self, value):
+        """
+        预解析模板（保持字典、列表的嵌套结构）
+        
+        Args:
+            value: 要解析的值（字符串、字典、列表等）
+            
+        Returns:
+            字符串替换为_CompiledTemplate后的值
+        """
+        if isinstance(value, str):
+            return _CompiledTemplate(value)
+        elif isinstance(value, dict):
+            return {k: self._compile_template(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [self._compile_template(item) for item in value]
+        else:
+            return value
+
+    def _render_template(self, template, user_info):
+        """按预解析的片段拼接模板字符串"""
+        if template.tokens is None:
+            return template.source.format(**user_info)
+        
+        parts = []
+        for literal, field_name, format_spec, conversion in template.tokens:
+            parts.append(literal)
+            if field_name is None:
+                continue
+            if not field_name or field_name[0] in '.[':
+                # 自动编号字段（如 {}、{[0]}）与str.format(**user_info)一致抛出IndexError
+                raise IndexError("Replacement index 0 out of range for positional args tuple")
+            obj, _ = _formatter.get_field(field_name, (), user_info)
+            if conversion:
+                obj = _formatter.convert_field(obj, conversion)
+            parts.append(format(obj, format_spec))
+        return ''.join(parts)
+
     def _format_template(self, value, user_info):
         """
         格式化单个值（支持递归格式化嵌套对象）
         
         Args:
-            value: 要格式化的值（字符串、字典、列表等）
+            value: 预解析后的值（模板、字典、列表等）
             user_info (dict): 用户信息
             
         Returns:
             格式化后的值
         """
-        if isinstance(value, str):
-            # 字符串类型，进行模板格式化
+        if isinstance(value, _CompiledTemplate):
+            # 模板字符串，进行格式化
             try:
-                return value.format(**user_info)
+                return self._render_template(value, user_info)
             except (KeyError, ValueError) as e:
                 logger.warning(f"模板格式化失败: {e}")
-                return value
+                return value.source
         elif isinstance(value, dict):
             # 字典类型，递归处理每个值
             result = {}
@@ -122,7 +209,7 @@ class WebhookNotifier:
         payload = {}
         
         # 遍历用户配置的body字段
-        for key, value in self.body_config.items():
+        for key, value in self._compiled_body.items():
             payload[key] = self._format_template(value, user_info)
         
         # 如果没有配置body字段，提示用户配置
@@ -156,29 +243,71 @@ class WebhookNotifier:
         if not self.url:
             return False
             
-        for attempt in range(self.retry_attempts):
-            try:
-                response = requests.post(
-                    self.url,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                
-                logger.info(f"Webhook通知发送成功 (尝试 {attempt + 1})")
-                return True
-                
-            except requests.exceptions.Timeout:
-                logger.warning(f"Webhook请求超时 (尝试 {attempt + 1}/{self.retry_attempts})")
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"Webhook请求失败 (尝试 {attempt + 1}/{self.retry_attempts}): {e}")
-            except Exception as e:
-                logger.error(f"Webhook发送异常 (尝试 {attempt + 1}/{self.retry_attempts}): {e}")
-                
-        logger.error(f"Webhook通知发送失败，已重试 {self.retry_attempts} 次")
+        try:
+            response = self.http.post(
+                self.url,
+                data=_json_dumps(payload),
+                headers={'Content-Type': 'application/json'},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            
+            logger.info("Webhook通知发送成功")
+            return True
+            
+        except requests.exceptions.RequestException as e:
+            retries = self._retries_made(e)
+            label = "Webhook请求超时" if self._is_timeout(e) else "Webhook通知发送失败"
+            if retries:
+                logger.error(f"{label}，已重试 {retries} 次: {e}")
+            else:
+                logger.error(f"{label}: {e}")
+        except Exception as e:
+            logger.error(f"Webhook发送异常: {e}")
         return False
 
+    def _is_timeout(self, error):
+        """
+        判断请求异常是否由超时引起
+        
+        重试耗尽后的读取超时会被包装为MaxRetryError，requests将其作为ConnectionError抛出
+        
+        Args:
+            error (RequestException): 请求异常
+            
+        Returns:
+            bool: 是否为超时
+        """
+        if isinstance(error, requests.exceptions.Timeout):
+            return True
+        reason = error.args[0] if error.args else None
+        if not isinstance(reason, MaxRetryError):
+            return False
+        # NewConnectionError（如连接被拒绝）出于兼容继承自超时异常，需排除
+        return (isinstance(reason.reason, Urllib3TimeoutError)
+                and not isinstance(reason.reason, NewConnectionError))
+
+    def _retries_made(self, error):
+        """
+        获取请求失败前实际发生的重试次数
+        
+        Args:
+            error (RequestException): 请求异常
+            
+        Returns:
+            int: 重试次数
+        """
+        response = getattr(error, 'response', None)
+        if response is not None:
+            # 返回了响应（如4xx/5xx），由urllib3记录的重试历史得出
+            retries = getattr(response.raw, 'retries', None)
+            return len(retries.history) if retries else 0
+        # 连接类错误仅在重试耗尽后才以MaxRetryError抛出
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            return self.retry_attempts
+        return 0
+
     def test_webhook(self):
         """
         测试Webhook配置